@@ -0,0 +1,17 @@
+from selectolax.lexbor import LexborHTMLParser
+
+# ==============================
+# Function to Extract Article Text
+# ==============================
+# Kept out of the Streamlit script so process-pool workers can unpickle it by module name:
+# the script is re-executed into a fresh __main__ on every rerun.
+def extract_text(html):
+    if not html:
+        return None
+
+    tree = LexborHTMLParser(html, encoding=True)  # Detect the charset of the raw bytes
+
+    # Extract main text from <p> tags
+    article_text = " ".join(node.text(separator=" ", strip=True) for node in tree.css("p"))
+
+    return article_text.strip() if article_text else None